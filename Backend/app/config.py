@@ -1,8 +1,38 @@
-import json
 import os
 from pathlib import Path
 from typing import Optional, Dict, Any
 
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib parser when orjson isn't installed
+    orjson = None
+    import json
+
+
+def read_json(path) -> Any:
+    """Parse a JSON file, using orjson when available"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json(path, obj: Any, indent: bool = False):
+    """Serialize obj to a JSON file, using orjson when available"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        data = orjson.dumps(obj, option=option)
+    else:
+        data = json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+DEFAULT_CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
+
 
 class Settings:
     _instance = None
@@ -16,26 +46,35 @@ class Settings:
     
     def __init__(self):
         if self._initialized:
-            self.load_config()  # Reload on each instantiation
+            # Reload only when the file changed since it was last read
+            if self._config_mtime() != self._mtime:
+                self.load_config()
             return
         self._initialized = True
         self.load_config()
     
+    def _config_mtime(self) -> Optional[float]:
+        try:
+            return self._config_path.stat().st_mtime
+        except OSError:
+            return None
+    
     def load_config(self):
         """Load configuration from JSON file"""
-        if self._config_path.exists():
+        self._mtime = self._config_mtime()
+        if self._mtime is not None:
             try:
-                with open(self._config_path, 'r') as f:
-                    config = json.load(f)
-                    self.gemini_api_key = config.get("gemini_api_key") or ""
-                    self.livekit_url = config.get("livekit_url") or ""
-                    self.livekit_api_key = config.get("livekit_api_key") or ""
-                    self.livekit_api_secret = config.get("livekit_api_secret") or ""
-                    self.deepgram_api_key = config.get("deepgram_api_key") or ""
-                    self.redis_url = config.get("redis_url", "redis://redis:6379")
-                    self.embedding_model = config.get("embedding_model", "sentence-transformers/all-MiniLM-L6-v2")
-                    self.chunk_size = config.get("chunk_size", 500)
-                    self.chunk_overlap = config.get("chunk_overlap", 50)
+                config = read_json(self._config_path)
+                self.gemini_api_key = config.get("gemini_api_key") or ""
+                self.livekit_url = config.get("livekit_url") or ""
+                self.livekit_api_key = config.get("livekit_api_key") or ""
+                self.livekit_api_secret = config.get("livekit_api_secret") or ""
+                self.deepgram_api_key = config.get("deepgram_api_key") or ""
+                self.redis_url = config.get("redis_url", "redis://redis:6379")
+                self.embedding_model = config.get("embedding_model", "sentence-transformers/all-MiniLM-L6-v2")
+                self.chunk_size = config.get("chunk_size", 500)
+                self.chunk_overlap = config.get("chunk_overlap", 50)
+                self.cors_origins = config.get("cors_origins") or list(DEFAULT_CORS_ORIGINS)
             except Exception as e:
                 print(f"Error loading config: {e}")
                 self._set_defaults()
@@ -53,6 +92,7 @@ class Settings:
         self.embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
         self.chunk_size = 500
         self.chunk_overlap = 50
+        self.cors_origins = list(DEFAULT_CORS_ORIGINS)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert settings to dictionary"""
@@ -65,14 +105,15 @@ class Settings:
             "redis_url": self.redis_url,
             "embedding_model": self.embedding_model,
             "chunk_size": self.chunk_size,
-            "chunk_overlap": self.chunk_overlap
+            "chunk_overlap": self.chunk_overlap,
+            "cors_origins": self.cors_origins
         }
     
     def save_config(self):
         """Save current settings to JSON file"""
         os.makedirs("data", exist_ok=True)
-        with open(self._config_path, 'w') as f:
-            json.dump(self.to_dict(), f, indent=2)
+        write_json(self._config_path, self.to_dict(), indent=True)
+        self._mtime = self._config_mtime()
 
 
 def get_settings():
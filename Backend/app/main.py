@@ -1,10 +1,12 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from typing import Optional, Dict, Any
 import os
 import logging
 import json
+import aiofiles
+import torch
 
 from app.config import get_settings
 from app.services.knowledge_base import KnowledgeBaseService
@@ -15,14 +17,16 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 settings = get_settings()
-app = FastAPI(title="Voice AI Backend")
+app = FastAPI(title="Voice AI Backend", default_response_class=ORJSONResponse)
 
+# Origins are read once at startup; changing cors_origins requires a restart
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=settings.cors_origins,
+    allow_credentials=False,
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
 kb_service = KnowledgeBaseService()
@@ -31,6 +35,15 @@ livekit_service = LiveKitService()
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("data", exist_ok=True)
 
+UPLOAD_CHUNK_SIZE = 1 << 20   # stream uploads to disk 1 MiB at a time
+
+
+@app.on_event("startup")
+async def warmup_models():
+    torch.set_num_threads(os.cpu_count() or 1)
+    await kb_service.warmup()
+    logger.info("Embedding model warmed up")
+
 
 @app.get("/")
 async def root():
@@ -47,21 +60,18 @@ async def upload_document(file: UploadFile = File(...)):
     try:
         file_path = os.path.join("uploads", file.filename)
         
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
         
         result = await kb_service.ingest_document(file_path, file.filename)
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": "Document uploaded and processed successfully",
-                "filename": file.filename,
-                "chunks": result["chunks"],
-                "doc_id": result["doc_id"]
-            }
-        )
+        return {
+            "message": "Document uploaded and processed successfully",
+            "filename": file.filename,
+            "chunks": result["chunks"],
+            "doc_id": result["doc_id"]
+        }
     except Exception as e:
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -81,8 +91,7 @@ async def list_documents():
 async def delete_document(doc_id: str):
     try:
         # Get document info to find filename
-        docs = await kb_service.list_documents()
-        doc_to_delete = next((doc for doc in docs if doc["doc_id"] == doc_id), None)
+        doc_to_delete = await kb_service.get_document(doc_id)
         
         if doc_to_delete:
             filename = doc_to_delete["filename"]
@@ -108,6 +117,23 @@ async def delete_document(doc_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/index/retrain")
+async def retrain_index():
+    """
+    Refit the vector quantiser on the whole corpus and drop deleted chunks
+    """
+    try:
+        result = await kb_service.retrain()
+        return {
+            "status": "success",
+            "message": "Index retrained successfully",
+            "vectors": result["vectors"]
+        }
+    except Exception as e:
+        logger.error(f"Error retraining index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/agent/prompt")
 async def update_prompt(prompt_data: PromptUpdate):
     try:
@@ -334,4 +360,13 @@ async def delete_all_documents():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # The knowledge base, system prompt and agent registry live in-process,
+    # so extra workers would each see their own copy; opt in via WEB_CONCURRENCY.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
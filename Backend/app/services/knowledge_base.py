@@ -1,17 +1,22 @@
 # knowledge_base.py  —  drop-in replacement
 import os
+import asyncio
+import hashlib
 import logging
-import json
+import threading
 import faiss
 import numpy as np
 import re
-from typing import List, Dict, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
 from datetime import datetime
+from numba import njit
 from sentence_transformers import SentenceTransformer
 from pypdf import PdfReader
 from docx import Document as DocxDocument
 
-from app.config import get_settings
+from app.config import get_settings, read_json, write_json
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -21,44 +26,156 @@ settings = get_settings()
 # Semantic / Structure-Aware Text Splitter
 # ---------------------------------------------------------------------------
 
+_HYPHEN_RE       = re.compile(r"-\n\s*")
+_BLANKS_RE       = re.compile(r"\n{3,}")
+_PARA_RE         = re.compile(r"\n\s*\n")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z\"'\(])")
+_TRANS           = str.maketrans({"\r": "", "\f": "\n\n"})
+# whitespace runs that might be a paragraph or sentence break (see _last_cut)
+_CUT_RE          = re.compile(r"(?:(?<=[.!?])\s+|\s*[\n\f]\s*)(?=\S)")
+_SENTENCE_START  = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ\"'(")
+
+
+@njit(cache=True)
+def _pack_kernel(lengths: np.ndarray, chunk_size: int, chunk_overlap: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedy sentence packer over sentence lengths.
+    Returns (starts, ends) sentence-index spans, one per chunk. A sentence
+    longer than chunk_size is emitted as its own single-sentence span.
+    """
+    n = lengths.shape[0]
+    starts = np.empty(2 * n, dtype=np.int64)   # each sentence closes at most two spans
+    ends   = np.empty(2 * n, dtype=np.int64)
+    count   = 0
+    start   = 0                                # current chunk is sentences[start:i]
+    cur_len = 0
+
+    for i in range(n):
+        sent_len = lengths[i]
+
+        if sent_len > chunk_size:              # single monster sentence
+            if i > start:
+                starts[count] = start
+                ends[count]   = i
+                count += 1
+            starts[count] = i
+            ends[count]   = i + 1
+            count += 1
+            start, cur_len = i + 1, 0
+            continue
+
+        if cur_len + sent_len + 1 > chunk_size and i > start:
+            starts[count] = start
+            ends[count]   = i
+            count += 1
+            # carry over the longest whole-sentence tail that fits chunk_overlap
+            total = 0
+            j = i
+            while j > start and total + lengths[j - 1] + 1 <= chunk_overlap:
+                j -= 1
+                total += lengths[j] + 1
+            # ...and still leaves room for the sentence that overflowed
+            while j < i and total + sent_len + 1 > chunk_size:
+                total -= lengths[j] + 1
+                j += 1
+            start   = j
+            cur_len = total
+
+        cur_len += sent_len + 1
+
+    if n > start:
+        starts[count] = start
+        ends[count]   = n
+        count += 1
+
+    return starts[:count], ends[:count]
+
 class SemanticTextSplitter:
     """
     Splits text respecting natural document structure:
       1. Rejoins PDF hyphenated line-breaks  (e.g. "docu-\nmentation" -> "documentation")
       2. Splits at paragraph/section boundaries first, then sentence endings
       3. Packs whole sentences into chunks; overlap is whole sentences too
+
+    split_stream does the same over an iterable of pages, yielding chunks
+    as soon as later pages can no longer change them.
     """
 
+    STREAM_FLUSH = 256   # buffered sentences before a finished prefix is packed
+
     def __init__(self, chunk_size: int = 600, chunk_overlap: int = 80):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
     def split_text(self, text: str) -> List[str]:
-        text = self._clean_text(text)
-        sentences = self._split_into_sentences(text)
-        return self._pack_sentences(sentences)
+        return list(self.split_stream([text]))
+
+    def split_stream(self, pages: Iterable[str]) -> Iterator[str]:
+        """
+        Split pages joined with "\n"; same chunks as split_text on the joined text.
+        Raw text after the last safe cut is carried to the next page uncleaned,
+        and only newly arrived text is scanned for a cut.
+        """
+        carry: List[str] = []   # raw pieces since the last cut
+        tail = ""               # last non-space char of carry + trailing whitespace
+        pending: List[str] = []
+        for n, page in enumerate(pages):
+            piece = f"\n{page}" if n else page
+            cut = self._last_cut(tail + piece, 1 if tail else 0)
+            if cut >= 0:
+                split = cut - len(tail)
+                head = "".join(carry) + piece[:split]
+                carry, piece = [], piece[split:]
+                pending.extend(self._split_into_sentences(_PARA_RE.split(self._clean_text(head))))
+            carry.append(piece)
+            stripped = piece.rstrip()
+            tail = piece[len(stripped) - 1:] if stripped else tail + piece
+
+            if len(pending) >= self.STREAM_FLUSH:
+                chunks, pending = self._pack_prefix(pending)
+                yield from chunks
+
+        rest = self._clean_text("".join(carry))
+        pending.extend(self._split_into_sentences(_PARA_RE.split(rest)))
+        yield from self._pack_sentences(pending)
+
+    def _last_cut(self, text: str, pos: int) -> int:
+        """
+        End of the last whitespace run at/after pos that is a paragraph or
+        sentence break no cleaning rule reaches across, or -1. Text before
+        and after such a cut cleans and splits independently.
+        """
+        cut = -1
+        for m in _CUT_RE.finditer(text, pos):
+            i, j = m.span()
+            if i == 0:
+                continue
+            prev, run = text[i - 1], m.group()
+            if prev == "-" and run[0] == "\n":     # hyphenated line-break, gets rejoined
+                continue
+            run = self._clean_text(run)
+            if _PARA_RE.search(run) or (run and prev in ".!?" and text[j] in _SENTENCE_START):
+                cut = j
+        return cut
 
     # --- Step 1: clean PDF noise -------------------------------------------
 
     def _clean_text(self, text: str) -> str:
         # Rejoin hyphenated line-breaks (PDF artefact: "docu-\n mentation")
-        text = re.sub(r"-\n\s*", "", text)
+        text = _HYPHEN_RE.sub("", text)
         # Collapse excessive blank lines
-        text = re.sub(r"\n{3,}", "\n\n", text)
-        text = text.replace("\r", "").replace("\f", "\n\n")
-        return text.strip()
+        text = _BLANKS_RE.sub("\n\n", text)
+        return text.translate(_TRANS)
 
     # --- Step 2: sentence tokenisation (no NLTK needed) --------------------
 
-    def _split_into_sentences(self, text: str) -> List[str]:
-        paragraphs = re.split(r"\n\s*\n", text)
+    def _split_into_sentences(self, paragraphs: Iterable[str]) -> List[str]:
         sentences: List[str] = []
-        sentence_end = re.compile(r"(?<=[.!?])\s+(?=[A-Z\"'\(])")
         for para in paragraphs:
             para = para.strip()
             if not para:
                 continue
-            for part in sentence_end.split(para):
+            for part in _SENTENCE_END_RE.split(para):
                 part = part.strip()
                 if part:
                     sentences.append(part)
@@ -67,44 +184,41 @@ class SemanticTextSplitter:
     # --- Step 3: pack whole sentences into chunks --------------------------
 
     def _pack_sentences(self, sentences: List[str]) -> List[str]:
+        if not sentences:
+            return []
+        lengths = self._lengths(sentences)
+        starts, ends = _pack_kernel(lengths, self.chunk_size, self.chunk_overlap)
+        return self._render(sentences, lengths, starts, ends)
+
+    def _pack_prefix(self, sentences: List[str]) -> Tuple[List[str], List[str]]:
+        """Pack all chunks but the last; return them plus the sentences to re-pack."""
+        lengths = self._lengths(sentences)
+        starts, ends = _pack_kernel(lengths, self.chunk_size, self.chunk_overlap)
+        if len(starts) < 2:
+            return [], sentences
+        last = int(starts[-1])
+        return self._render(sentences, lengths, starts[:-1], ends[:-1]), sentences[last:]
+
+    @staticmethod
+    def _lengths(sentences: List[str]) -> np.ndarray:
+        return np.fromiter((len(s) for s in sentences), dtype=np.int64, count=len(sentences))
+
+    def _render(
+        self,
+        sentences: List[str],
+        lengths:   np.ndarray,
+        starts:    np.ndarray,
+        ends:      np.ndarray,
+    ) -> List[str]:
         chunks: List[str] = []
-        current_parts: List[str] = []
-        current_len = 0
-
-        for sent in sentences:
-            sent_len = len(sent)
-
-            if sent_len > self.chunk_size:          # single monster sentence
-                if current_parts:
-                    chunks.append(" ".join(current_parts))
-                    current_parts, current_len = [], 0
-                chunks.extend(self._hard_split(sent))
-                continue
-
-            if current_len + sent_len + 1 > self.chunk_size and current_parts:
-                chunks.append(" ".join(current_parts))
-                overlap_parts = self._build_overlap(current_parts)
-                current_parts = overlap_parts
-                current_len = sum(len(s) for s in current_parts)
-
-            current_parts.append(sent)
-            current_len += sent_len + 1
-
-        if current_parts:
-            chunks.append(" ".join(current_parts))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end - start == 1 and lengths[start] > self.chunk_size:
+                chunks.extend(self._hard_split(sentences[start]))
+            else:
+                chunks.append(" ".join(sentences[start:end]))
 
         return [c.strip() for c in chunks if c.strip()]
 
-    def _build_overlap(self, parts: List[str]) -> List[str]:
-        overlap: List[str] = []
-        total = 0
-        for sent in reversed(parts):
-            if total + len(sent) + 1 > self.chunk_overlap:
-                break
-            overlap.insert(0, sent)
-            total += len(sent) + 1
-        return overlap
-
     def _hard_split(self, text: str) -> List[str]:
         return [
             text[i: i + self.chunk_size]
@@ -112,32 +226,139 @@ class SemanticTextSplitter:
         ]
 
 
+# ---------------------------------------------------------------------------
+# MMR kernel
+# ---------------------------------------------------------------------------
+
+@njit(cache=True, fastmath=True)
+def _mmr_kernel(cand_vecs: np.ndarray, rel_scores: np.ndarray, k: int, lam: float) -> np.ndarray:
+    """
+    Greedy MMR over pre-materialised candidate vectors.
+    Returns the candidate positions in selection order.
+    """
+    n, dim = cand_vecs.shape
+    k = min(k, n)
+    order    = np.empty(k, dtype=np.int64)
+    chosen   = np.zeros(n, dtype=np.bool_)
+    max_sim  = np.zeros(n, dtype=np.float32)   # similarity to the closest selected vector
+
+    for step in range(k):
+        best       = -1
+        best_score = 0.0
+        for i in range(n):
+            if chosen[i]:
+                continue
+            if step == 0:
+                score = rel_scores[i]
+            else:
+                score = lam * rel_scores[i] - (1.0 - lam) * max_sim[i]
+            if best < 0 or score > best_score:
+                best       = i
+                best_score = score
+
+        chosen[best] = True
+        order[step]  = best
+
+        # fold the new pick into max_sim incrementally: one pass over n x dim
+        for i in range(n):
+            if chosen[i]:
+                continue
+            sim = np.float32(0.0)
+            for j in range(dim):
+                sim += cand_vecs[i, j] * cand_vecs[best, j]
+            if step == 0 or sim > max_sim[i]:
+                max_sim[i] = sim
+
+    return order
+
+
 # ---------------------------------------------------------------------------
 # Knowledge Base Service
 # ---------------------------------------------------------------------------
 
+class _RWLock:
+    """Any number of readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._cond    = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
 class KnowledgeBaseService:
     """
     FAISS vector store with:
-      - Cosine similarity (IndexFlatIP on L2-normalised embeddings)
+      - Cosine similarity (HNSW inner-product graph on L2-normalised embeddings,
+        8-bit scalar-quantised over the fixed [-1, 1] range of unit vectors)
       - Score threshold to discard irrelevant chunks
       - MMR deduplication for diverse, high-quality results
+      - Tombstoned deletes (HNSW has no remove_ids); compacted once
+        COMPACT_RATIO of the rows are dead
     """
 
     SCORE_THRESHOLD = 0.30   # cosine sim below this -> discard
     MMR_LAMBDA      = 0.7    # 1.0 = pure relevance, 0.0 = pure diversity
+    HNSW_M          = 32     # graph neighbours per node
+    HNSW_EF_BUILD   = 200    # efConstruction
+    HNSW_EF_SEARCH  = 64     # efSearch, recall >= 0.95 at M=32
+    COMPACT_RATIO   = 0.5    # rebuild the index once this fraction of rows is deleted
+    EMBED_BATCH     = 64     # chunks embedded per flush while a document streams in
+    QUERY_CACHE_SIZE = 1024  # LRU entries of query embeddings
 
     def __init__(self):
         self.embedding_model = SentenceTransformer(settings.embedding_model)
+        self.embedding_model.max_seq_length = 256
+        if self.embedding_model.device.type == "cuda":
+            self.embedding_model.half()             # fp16 weights on GPU
         self.dimension = 384                        # all-MiniLM-L6-v2
-        self.index = faiss.IndexFlatIP(self.dimension)   # cosine via normalised IP
-        self.metadata: List[Dict] = []
+        self.index = self._new_index()                   # cosine via normalised IP
+        self._vecs = np.zeros((0, self.dimension), dtype=np.float16)  # row-aligned mirror of the index
+        self._vec_buf = self._vecs                  # _vecs is a prefix view of this
+        self.metadata: List[Optional[Dict]] = []    # row-aligned with the index; None = deleted
+        self.doc_index: Dict[str, Dict] = {}        # doc_id -> {doc_id, filename, chunks, created_at}
+        self._doc_rows: Dict[str, List[int]] = {}   # doc_id -> index rows
+        self._dead = 0                              # tombstoned rows still in the index
+        self._lock = threading.Lock()               # serialises writers (ingest / delete / rebuild)
+        self._rw   = _RWLock()                      # searches vs. brief in-place mutations
+        self._query_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
         self.text_splitter = SemanticTextSplitter(
             chunk_size=settings.chunk_size,
             chunk_overlap=settings.chunk_overlap,
         )
         self.index_path   = "data/faiss_index"
         self.metadata_path = "data/metadata.json"
+        self.doc_index_path = "data/documents.json"
         self._load_index()
 
     # --- persistence -------------------------------------------------------
@@ -147,10 +368,30 @@ class KnowledgeBaseService:
             if os.path.exists(f"{self.index_path}.index"):
                 self.index = faiss.read_index(f"{self.index_path}.index")
                 logger.info("Loaded existing FAISS index")
+                if os.path.exists(f"{self.index_path}.npy"):
+                    # demand-paged and shared through the page cache; the first
+                    # write (vstack / mask) replaces it with an in-memory copy
+                    self._vecs = np.load(f"{self.index_path}.npy", mmap_mode="r")
+                else:                   # index saved before the mirror existed
+                    self._vecs = self.index.reconstruct_n(0, self.index.ntotal)
+                if self._vecs.dtype != np.float16:
+                    self._vecs = self._vecs.astype(np.float16)
+                self._vec_buf = self._vecs
             if os.path.exists(self.metadata_path):
-                with open(self.metadata_path, "r") as f:
-                    self.metadata = json.load(f)
+                self.metadata = read_json(self.metadata_path)
                 logger.info(f"Loaded {len(self.metadata)} metadata entries")
+            if os.path.exists(self.doc_index_path):
+                self.doc_index = read_json(self.doc_index_path)
+            else:                       # metadata saved before the doc index existed
+                self.doc_index = self._build_doc_index(self.metadata)
+            self._rebuild_row_map()
+
+            if isinstance(self.index, faiss.IndexHNSWSQ) and np.array_equal(
+                self._sq_ranges(self.index), self._sq_ranges(self._new_index())
+            ):
+                self.index.hnsw.efSearch = self.HNSW_EF_SEARCH
+            else:   # flat / HNSWFlat, or SQ8 ranges fitted on the data of the day
+                self._compact()
         except Exception as e:
             logger.error(f"Error loading index: {e}")
 
@@ -158,60 +399,203 @@ class KnowledgeBaseService:
         try:
             os.makedirs("data", exist_ok=True)
             faiss.write_index(self.index, f"{self.index_path}.index")
-            with open(self.metadata_path, "w") as f:
-                json.dump(self.metadata, f)
+            # _vecs may be a memmap of this very file: write aside, then swap in
+            tmp_path = f"{self.index_path}.npy.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self._vecs)
+            os.replace(tmp_path, f"{self.index_path}.npy")
+            write_json(self.metadata_path, self.metadata)
+            write_json(self.doc_index_path, self.doc_index)
             logger.info("Saved FAISS index and metadata")
         except Exception as e:
             logger.error(f"Error saving index: {e}")
 
+    @staticmethod
+    def _build_doc_index(metadata: List[Optional[Dict]]) -> Dict[str, Dict]:
+        doc_index: Dict[str, Dict] = {}
+        for meta in metadata:
+            if meta is None:
+                continue
+            d = meta["doc_id"]
+            if d not in doc_index:
+                doc_index[d] = {
+                    "doc_id":     d,
+                    "filename":   meta["filename"],
+                    "chunks":     0,
+                    "created_at": meta["created_at"],
+                }
+            doc_index[d]["chunks"] += 1
+        return doc_index
+
+    def _rebuild_row_map(self):
+        self._doc_rows = {}
+        self._dead     = 0
+        for row, meta in enumerate(self.metadata):
+            if meta is None:
+                self._dead += 1
+            else:
+                self._doc_rows.setdefault(meta["doc_id"], []).append(row)
+
+    def _compact(self):
+        """
+        Drop tombstoned rows and rebuild the index from the live vectors.
+        Caller holds _lock, so no other write can land mid-rebuild; searches
+        keep using the old index and only wait for the final swap.
+        """
+        keep = np.fromiter(
+            (m is not None for m in self.metadata), dtype=np.bool_, count=len(self.metadata)
+        )
+        vecs     = self._vecs[keep]
+        metadata = [m for m in self.metadata if m is not None]
+        index    = self._new_index()
+        if len(vecs):
+            index.add(vecs.astype(np.float32))
+
+        with self._rw.write():
+            self.index, self._vecs, self._vec_buf, self.metadata = index, vecs, vecs, metadata
+            self._rebuild_row_map()
+        self._save_index()
+        logger.info(f"Compacted index to {len(metadata)} rows")
+
     # --- helpers -----------------------------------------------------------
 
-    def _extract_text(self, file_path: str) -> str:
+    def _new_index(self) -> faiss.Index:
+        index = faiss.IndexHNSWSQ(
+            self.dimension, faiss.ScalarQuantizer.QT_8bit, self.HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        # embeddings are unit-normalised, so every component lies in [-1, 1]:
+        # fix the SQ8 ranges there instead of fitting them on a small early corpus
+        ones = np.ones(self.dimension, dtype=np.float32)
+        index.train(np.stack([-ones, ones]))
+        index.hnsw.efConstruction = self.HNSW_EF_BUILD
+        index.hnsw.efSearch       = self.HNSW_EF_SEARCH
+        return index
+
+    @staticmethod
+    def _sq_ranges(index: faiss.IndexHNSWSQ) -> np.ndarray:
+        return faiss.vector_to_array(faiss.downcast_index(index.storage).sq.trained)
+
+    def _append_vecs(self, new: np.ndarray) -> np.ndarray:
+        """
+        Mirror with `new` appended. The buffer grows geometrically, so an
+        upload copies only its own rows; rows a search may be reading are
+        never written.
+        """
+        n, k = len(self._vecs), len(new)
+        buf  = self._vec_buf
+        if n + k > len(buf) or not buf.flags.writeable:     # full, or the loaded memmap
+            buf = np.empty((max(2 * (n + k), 1024), self.dimension), dtype=np.float16)
+            buf[:n] = self._vecs
+            self._vec_buf = buf
+        buf[n:n + k] = new
+        return buf[:n + k]
+
+    def _iter_pages(self, file_path: str) -> Iterator[str]:
+        """Yield document text page by page (PDF) or whole (DOCX / TXT)."""
         ext = os.path.splitext(file_path)[1].lower()
         if ext == ".pdf":
             reader = PdfReader(file_path)
-            return "\n".join(page.extract_text() or "" for page in reader.pages)
+            for page in reader.pages:
+                yield page.extract_text() or ""
         elif ext == ".docx":
             doc = DocxDocument(file_path)
-            return "\n".join(p.text for p in doc.paragraphs)
+            yield "\n".join(p.text for p in doc.paragraphs)
         elif ext == ".txt":
             with open(file_path, "r", encoding="utf-8") as f:
-                return f.read()
-        raise ValueError(f"Unsupported file format: {ext}")
+                yield f.read()
+        else:
+            raise ValueError(f"Unsupported file format: {ext}")
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         """Encode + L2-normalise  ->  dot-product == cosine similarity."""
-        vecs = self.embedding_model.encode(texts, show_progress_bar=False)
-        arr  = np.array(vecs, dtype="float32")
-        faiss.normalize_L2(arr)
-        return arr
-
-    def _get_vector(self, idx: int) -> np.ndarray:
-        vec = np.zeros(self.dimension, dtype="float32")
-        self.index.reconstruct(idx, vec)
+        vecs = self.embedding_model.encode(
+            texts,
+            batch_size=64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return np.asarray(vecs, dtype="float32")    # no copy unless the model ran in fp16
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        """_embed([query]) memoised in an LRU keyed by the query's blake2b digest."""
+        key = hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest()
+        with self._query_cache_lock:
+            vec = self._query_cache.get(key)
+            if vec is not None:
+                self._query_cache.move_to_end(key)
+                return vec
+
+        vec = self._embed([query])
+        vec.flags.writeable = False                 # shared by every caller of this query
+        with self._query_cache_lock:
+            self._query_cache[key] = vec
+            if len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
         return vec
 
+    async def embed_query(self, query: str) -> np.ndarray:
+        """Normalised (1, dim) query vector, shared with retrieve()'s cache."""
+        return await asyncio.to_thread(self._embed_query, query)
+
+    async def warmup(self):
+        """Run one throwaway encode so the first real query skips model warm-up."""
+        await asyncio.to_thread(self._embed, ["warmup"])
+
     # --- ingest ------------------------------------------------------------
 
     async def ingest_document(self, file_path: str, filename: str) -> Dict:
+        return await asyncio.to_thread(self._ingest_sync, file_path, filename)
+
+    def _ingest_sync(self, file_path: str, filename: str) -> Dict:
         try:
-            text   = self._extract_text(file_path)
-            chunks = self.text_splitter.split_text(text)
-            doc_id = f"doc_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-
-            embeddings = self._embed(chunks)
-            self.index.add(embeddings)
-
-            for i, chunk in enumerate(chunks):
-                self.metadata.append({
-                    "doc_id":      doc_id,
-                    "filename":    filename,
-                    "chunk_index": i,
-                    "text":        chunk,
-                    "created_at":  datetime.now().isoformat(),
-                })
-
-            self._save_index()
+            now     = datetime.now()             # one clock read for the whole document
+            doc_id  = f"doc_{now.strftime('%Y%m%d_%H%M%S')}_{filename}"
+            created = now.isoformat()
+
+            # embed in batches while pages are still being extracted and split
+            chunks: List[str] = []
+            batches: List[np.ndarray] = []
+            for chunk in self.text_splitter.split_stream(self._iter_pages(file_path)):
+                chunks.append(chunk)
+                if len(chunks) % self.EMBED_BATCH == 0:
+                    batches.append(self._embed(chunks[-self.EMBED_BATCH:]))
+            tail = len(chunks) % self.EMBED_BATCH
+            if tail:
+                batches.append(self._embed(chunks[-tail:]))
+            embeddings = (
+                np.vstack(batches) if batches else np.zeros((0, self.dimension), dtype="float32")
+            )
+
+            with self._lock:
+                first_row = len(self.metadata)
+                vecs = self._append_vecs(embeddings.astype(np.float16))
+                rows = [
+                    {
+                        "doc_id":      doc_id,
+                        "filename":    filename,
+                        "chunk_index": i,
+                        "text":        chunk,
+                        "created_at":  created,
+                    }
+                    for i, chunk in enumerate(chunks)
+                ]
+
+                with self._rw.write():
+                    if len(embeddings):
+                        self.index.add(embeddings)
+                    self._vecs = vecs
+                    self.metadata.extend(rows)
+                    self._doc_rows.setdefault(doc_id, []).extend(range(first_row, first_row + len(chunks)))
+
+                    doc = self.doc_index.setdefault(doc_id, {
+                        "doc_id":     doc_id,
+                        "filename":   filename,
+                        "chunks":     0,
+                        "created_at": created,
+                    })
+                    doc["chunks"] += len(chunks)
+                self._save_index()
             logger.info(f"Ingested '{filename}' -> {len(chunks)} chunks")
             return {"doc_id": doc_id, "filename": filename, "chunks": len(chunks)}
 
@@ -222,6 +606,9 @@ class KnowledgeBaseService:
     # --- retrieval ---------------------------------------------------------
 
     async def retrieve(self, query: str, top_k: int = 5) -> Dict:
+        return await asyncio.to_thread(self._retrieve_sync, query, top_k)
+
+    def _retrieve_sync(self, query: str, top_k: int) -> Dict:
         """
         1. Embed & normalise query
         2. FAISS IP search (= cosine sim)
@@ -230,35 +617,39 @@ class KnowledgeBaseService:
         5. Return top_k diverse, relevant chunks
         """
         try:
-            if not self.metadata:
+            if len(self.metadata) == self._dead:
                 return {"chunks": [], "sources": [], "scores": []}
 
-            q_vec   = self._embed([query])
-            fetch_k = min(top_k * 4, len(self.metadata))
-            scores, indices = self.index.search(q_vec, fetch_k)
-            scores, indices = scores[0], indices[0]
-
-            candidates: List[Tuple[int, float]] = [
-                (int(idx), float(score))
-                for idx, score in zip(indices, scores)
-                if idx < len(self.metadata) and float(score) >= self.SCORE_THRESHOLD
-            ]
-
-            if not candidates:          # relax threshold if nothing passes
-                candidates = [
-                    (int(idx), float(score))
-                    for idx, score in zip(indices[:top_k], scores[:top_k])
-                    if idx < len(self.metadata)
-                ]
-
-            selected = self._mmr_select(q_vec[0], candidates, top_k)
-
-            chunks, sources, final_scores = [], [], []
-            for idx, score in selected:
-                meta = self.metadata[idx]
-                chunks.append(meta["text"])
-                sources.append(f"{meta['filename']} (chunk {meta['chunk_index']})")
-                final_scores.append(round(score, 4))
+            q_vec = self._embed_query(query)
+
+            # shared: concurrent searches don't wait for each other, only for a write
+            with self._rw.read():
+                total = len(self.metadata)
+                live  = max(total - self._dead, 1)
+                # over-fetch in proportion to tombstones so ~top_k*4 live rows come back
+                fetch_k = min(-(-top_k * 4 * total // live), total)
+                scores, indices = self.index.search(q_vec, fetch_k)
+                scores, indices = scores[0], indices[0]
+
+                # drop missing (-1) and tombstoned hits with a mask, not list rebuilds
+                keep = indices >= 0
+                keep[keep] = [self.metadata[i] is not None for i in indices[keep].tolist()]
+                cand_ids, rel_scores = indices[keep], scores[keep]
+
+                passing = rel_scores >= self.SCORE_THRESHOLD
+                if passing.any():
+                    cand_ids, rel_scores = cand_ids[passing], rel_scores[passing]
+                else:                       # relax threshold if nothing passes
+                    cand_ids, rel_scores = cand_ids[:top_k], rel_scores[:top_k]
+
+                order = self._mmr_select(cand_ids, rel_scores, top_k)
+
+                chunks, sources, final_scores = [], [], []
+                for pos in order.tolist():
+                    meta = self.metadata[int(cand_ids[pos])]
+                    chunks.append(meta["text"])
+                    sources.append(f"{meta['filename']} (chunk {meta['chunk_index']})")
+                    final_scores.append(round(float(rel_scores[pos]), 4))
 
             logger.info(f"Retrieved {len(chunks)} chunks | scores: {final_scores}")
             return {"chunks": chunks, "sources": sources, "scores": final_scores}
@@ -269,77 +660,80 @@ class KnowledgeBaseService:
 
     def _mmr_select(
         self,
-        query_vec:  np.ndarray,
-        candidates: List[Tuple[int, float]],
+        cand_ids:   np.ndarray,
+        rel_scores: np.ndarray,
         k:          int,
-    ) -> List[Tuple[int, float]]:
-        """Maximal Marginal Relevance — relevance minus redundancy."""
-        selected:  List[Tuple[int, float]] = []
-        remaining = list(candidates)
-
-        while remaining and len(selected) < k:
-            if not selected:
-                best = max(remaining, key=lambda x: x[1])
-            else:
-                sel_vecs   = np.array([self._get_vector(i) for i, _ in selected], dtype="float32")
-                best_score = -np.inf
-                best       = remaining[0]
-                for idx, rel in remaining:
-                    cand_vec         = self._get_vector(idx)
-                    sim_to_selected  = float(np.max(sel_vecs @ cand_vec))
-                    mmr              = self.MMR_LAMBDA * rel - (1 - self.MMR_LAMBDA) * sim_to_selected
-                    if mmr > best_score:
-                        best_score = mmr
-                        best = (idx, rel)
-
-            selected.append(best)
-            remaining.remove(best)
-
-        return selected
+    ) -> np.ndarray:
+        """Maximal Marginal Relevance — relevance minus redundancy.
+        Returns positions into cand_ids in selection order."""
+        if len(cand_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        cand_vecs = self._vecs[cand_ids].astype(np.float32)   # fp16 mirror -> fp32 kernel input
+        return _mmr_kernel(cand_vecs, rel_scores.astype(np.float32), k, self.MMR_LAMBDA)
 
     # --- management --------------------------------------------------------
 
     async def list_documents(self) -> List[Dict]:
-        docs_map: Dict[str, Dict] = {}
-        for meta in self.metadata:
-            d = meta["doc_id"]
-            if d not in docs_map:
-                docs_map[d] = {
-                    "doc_id":     d,
-                    "filename":   meta["filename"],
-                    "chunks":     0,
-                    "created_at": meta["created_at"],
-                }
-            docs_map[d]["chunks"] += 1
-        return list(docs_map.values())
+        return list(self.doc_index.values())
+
+    async def get_document(self, doc_id: str) -> Optional[Dict]:
+        return self.doc_index.get(doc_id)
 
     async def delete_document(self, doc_id: str):
+        await asyncio.to_thread(self._delete_sync, doc_id)
+
+    def _delete_sync(self, doc_id: str):
         try:
-            keep = [i for i, m in enumerate(self.metadata) if m["doc_id"] != doc_id]
-            if len(keep) == len(self.metadata):
-                raise ValueError(f"Document {doc_id} not found")
-
-            new_index = faiss.IndexFlatIP(self.dimension)
-            new_meta  = []
-            for idx in keep:
-                vec = self._get_vector(idx)
-                new_index.add(vec.reshape(1, -1))
-                new_meta.append(self.metadata[idx])
-
-            self.index    = new_index
-            self.metadata = new_meta
-            self._save_index()
+            with self._lock:
+                if doc_id not in self.doc_index:
+                    raise ValueError(f"Document {doc_id} not found")
+
+                # tombstone the doc's rows; search skips them until the next compaction
+                with self._rw.write():
+                    rows = self._doc_rows.pop(doc_id, [])
+                    for row in rows:
+                        self.metadata[row] = None
+                    self._dead += len(rows)
+                    del self.doc_index[doc_id]
+
+                if self._dead > self.COMPACT_RATIO * len(self.metadata):
+                    self._compact()
+                else:
+                    self._save_index()
             logger.info(f"Deleted document {doc_id}")
         except Exception as e:
             logger.error(f"Error deleting document: {e}")
             raise
 
+    async def retrain(self) -> Dict:
+        return await asyncio.to_thread(self._retrain_sync)
+
+    def _retrain_sync(self) -> Dict:
+        try:
+            with self._lock:
+                self._compact()
+            logger.info(f"Rebuilt index on {self.index.ntotal} vectors")
+            return {"vectors": self.index.ntotal}
+        except Exception as e:
+            logger.error(f"Error retraining index: {e}")
+            raise
+
     async def clear_all(self):
+        await asyncio.to_thread(self._clear_sync)
+
+    def _clear_sync(self):
         try:
-            self.index    = faiss.IndexFlatIP(self.dimension)
-            self.metadata = []
-            self._save_index()
+            with self._lock:
+                with self._rw.write():
+                    self.index    = self._new_index()
+                    self._vecs    = np.zeros((0, self.dimension), dtype=np.float16)
+                    self._vec_buf = self._vecs
+                    self.metadata = []
+                    self.doc_index = {}
+                    self._doc_rows = {}
+                    self._dead     = 0
+                self._save_index()
             logger.info("Cleared all documents")
         except Exception as e:
             logger.error(f"Error clearing knowledge base: {e}")
-            raise
\ No newline at end of file
+            raise
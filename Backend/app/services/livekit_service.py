@@ -1,4 +1,5 @@
 import logging
+from dataclasses import dataclass
 from livekit import api, rtc
 from typing import Optional, Dict
 import asyncio
@@ -10,10 +11,17 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
+@dataclass(slots=True)
+class AgentState:
+    """Per-room agent bookkeeping"""
+    status: str
+    started_at: float
+
+
 class LiveKitService:
     def __init__(self):
         self.system_prompt = "You are a helpful AI assistant. Answer questions based on the provided context."
-        self.active_agents = {}
+        self.active_agents: Dict[str, AgentState] = {}
     
     async def create_token(self, room_name: str, participant_name: str) -> str:
         """Create a LiveKit access token for a participant"""
@@ -59,10 +67,10 @@ class LiveKitService:
                     "room_name": room_name
                 }
             
-            self.active_agents[room_name] = {
-                "status": "running",
-                "started_at": asyncio.get_event_loop().time()
-            }
+            self.active_agents[room_name] = AgentState(
+                status="running",
+                started_at=asyncio.get_running_loop().time()
+            )
             
             logger.info(f"Started agent in room {room_name}")
             
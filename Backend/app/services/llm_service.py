@@ -1,31 +1,308 @@
+import asyncio
+import functools
+import hashlib
 import logging
+import time
+from datetime import timedelta
+from itertools import islice
 import google.generativeai as genai
-from typing import Optional, List, Dict
+import redis.asyncio as aioredis
+from cachetools import TTLCache
+from google.generativeai import caching
+from typing import Optional, List, Dict, Iterable
 
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+MODEL_NAME = "gemini-2.5-flash"
+
+# Explicit context caching: the stable prefix (system prompt + retrieved
+# context) is stored server-side and each turn only sends the delta.
+CACHE_TTL = timedelta(minutes=10)
+CACHE_MIN_CHARS = 4096      # ~1k tokens, below the API's minimum cache size
+
+CONTEXT_BLOCK_CACHE = 32    # formatted "Relevant Context" sections kept per service
+HISTORY_TURNS = 5           # most recent turns quoted verbatim in the prompt
+MAX_TOP_K = 32              # context headers prebuilt up to this many chunks
+_CTX_HEADERS = tuple(f"Context {i+1}:\n" for i in range(MAX_TOP_K))
+
+# Response cache: a repeat of the same (system prompt, context, history,
+# question) within the TTL skips the API entirely. Shared by every
+# LLMService in the process; Redis, when reachable, shares hits across
+# workers.
+RESPONSE_CACHE_TTL = 300
+REDIS_RETRY_S = 60
+
+_response_cache: TTLCache = TTLCache(maxsize=1024, ttl=RESPONSE_CACHE_TTL)
+_inflight: Dict[str, asyncio.Task] = {}     # coalesces concurrent identical calls
+_redis: Optional[aioredis.Redis] = None
+_redis_retry_at = 0.0
+
+
+@functools.lru_cache(maxsize=1)
+def get_model(api_key: str) -> genai.GenerativeModel:
+    """Process-wide model, so every room reuses one client connection pool"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+def _chunk_text(chunk) -> str:
+    """
+    Text of one streamed chunk, read straight from its parts. The .text
+    accessor re-validates and re-joins the candidate on every call; it is
+    only used as the fallback for chunks without a plain part list.
+    """
+    try:
+        parts = chunk.candidates[0].content.parts
+        if len(parts) == 1:
+            return parts[0].text
+        return "".join(part.text for part in parts)
+    except (AttributeError, IndexError):
+        try:
+            return chunk.text
+        except ValueError:      # no text at all, e.g. a bare finish_reason chunk
+            return ""
+
+
+def _response_key(
+    system_prompt: str,
+    context_chunks: Optional[List[str]],
+    history_section: str,
+    query: str
+) -> str:
+    chunks = context_chunks or []
+    h = hashlib.blake2b(digest_size=16)
+    for part in (system_prompt, str(len(chunks)), *chunks, history_section, query):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _redis_client() -> Optional[aioredis.Redis]:
+    global _redis
+    if time.monotonic() < _redis_retry_at:
+        return None
+    if _redis is None:
+        _redis = aioredis.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            socket_connect_timeout=0.05,
+            socket_timeout=0.05,
+        )
+    return _redis
+
+
+def _redis_down(e: Exception):
+    global _redis_retry_at
+    now = time.monotonic()
+    if now < _redis_retry_at:   # concurrent failures, already reported
+        return
+    _redis_retry_at = now + REDIS_RETRY_S
+    logger.warning(f"Redis response cache unavailable, using local cache only: {e}")
+
+
+async def _redis_get(key: str) -> Optional[str]:
+    client = _redis_client()
+    if client is None:
+        return None
+    try:
+        return await client.get(f"llm:{key}")
+    except Exception as e:
+        _redis_down(e)
+        return None
+
+
+async def _redis_set(key: str, value: str):
+    client = _redis_client()
+    if client is None:
+        return
+    try:
+        await client.set(f"llm:{key}", value, ex=RESPONSE_CACHE_TTL)
+    except Exception as e:
+        _redis_down(e)
+
+
+def _inflight_done(key: str, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()    # mark retrieved: every waiter may have gone away
+
 
 class LLMService:
     """LLM service using Google Gemini Flash 2.5"""
     
     def __init__(self):
-        genai.configure(api_key=settings.gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
         self.system_prompt = "You are a helpful AI assistant."
+        self._system_block = self.system_prompt
+        self._context_blocks: Dict[tuple, str] = {}
+        self._cache: Optional[caching.CachedContent] = None
+        self._reset_cache()
+    
+    @property
+    def model(self) -> genai.GenerativeModel:
+        return get_model(settings.gemini_api_key)
     
     def set_system_prompt(self, prompt: str):
         """Update the system prompt"""
         self.system_prompt = prompt
+        self._system_block = prompt
+        self._reset_cache()  # cached prefix embeds the old prompt
         logger.info(f"Updated system prompt: {prompt[:50]}...")
     
+    def _reset_cache(self):
+        self._drop_cache()
+        self._cache_key: Optional[str] = None
+        self._cached_model: Optional[genai.GenerativeModel] = None
+        self._cache_expires = 0.0
+        self._last_key: Optional[str] = None    # prefix seen on the previous turn
+        self._failed_key: Optional[str] = None  # prefix the API refused to cache
+    
+    def _drop_cache(self):
+        """Delete the server-side cache being replaced rather than leave it to its TTL"""
+        cache, self._cache = self._cache, None
+        if cache is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:                # called outside the event loop
+            self._delete_cache(cache)
+            return
+        loop.run_in_executor(None, self._delete_cache, cache)
+    
+    @staticmethod
+    def _delete_cache(cache: caching.CachedContent):
+        try:
+            cache.delete()
+            logger.info(f"Deleted context cache {cache.name}")
+        except Exception as e:              # already expired server-side, or unreachable
+            logger.warning(f"Could not delete context cache {cache.name}: {e}")
+    
+    def _prefix_key(self, context_chunks: Optional[List[str]]) -> str:
+        h = hashlib.sha256(self.system_prompt.encode())
+        for chunk in context_chunks or ():
+            h.update(b"\0")
+            h.update(chunk.encode())
+        return h.hexdigest()
+    
+    @staticmethod
+    def _context_text(context_chunks: Optional[List[str]]) -> str:
+        parts = []
+        append = parts.append
+        for i, chunk in enumerate(context_chunks or []):
+            if i:
+                append("\n\n")
+            append(_CTX_HEADERS[i] if i < MAX_TOP_K else f"Context {i+1}:\n")
+            append(chunk)
+        return "".join(parts)
+    
+    def _context_block(self, context_chunks: Optional[List[str]]) -> str:
+        """Formatted context section, reused while retrieval returns the same chunks"""
+        if not context_chunks:
+            return ""
+        key = tuple(context_chunks)
+        block = self._context_blocks.get(key)
+        if block is None:
+            if len(self._context_blocks) >= CONTEXT_BLOCK_CACHE:
+                self._context_blocks.pop(next(iter(self._context_blocks)))
+            block = self._context_blocks[key] = (
+                "\n\nRelevant Context:\n" + self._context_text(context_chunks)
+            )
+        return block
+    
+    @staticmethod
+    def _history_section(
+        conversation_history: Optional[Iterable[Dict]],
+        summary: Optional[str] = None,
+        history_block: Optional[str] = None
+    ) -> str:
+        """Summary of older turns (if any) plus the last 5 turns verbatim"""
+        parts = []
+        if summary:
+            parts.append("\n\nConversation Summary:\n" + summary)
+        if history_block is None and conversation_history:
+            # works for lists and deques alike; deques can't be sliced
+            recent = list(islice(reversed(conversation_history), HISTORY_TURNS))[::-1]
+            # turns may be {"role", "content"} dicts or (role, content, ...) tuples
+            history_block = "\n".join([
+                f"{msg['role']}: {msg['content']}" if isinstance(msg, dict)
+                else f"{msg[0]}: {msg[1]}"
+                for msg in recent
+            ])
+        if history_block:
+            parts.append("\n\nConversation History:\n" + history_block)
+        return "".join(parts)
+    
+    def _build_prompt(
+        self,
+        query: str,
+        context_chunks: Optional[List[str]],
+        history_section: str
+    ) -> str:
+        # one join over prebuilt sections; same text as the old "\n".join of parts
+        return "".join([
+            self._system_block,
+            self._context_block(context_chunks),
+            history_section,
+            "\n\nUser Question: ", query,
+            "\n\nAssistant Response:",
+        ])
+    
+    async def _get_cached_model(
+        self,
+        context_chunks: Optional[List[str]]
+    ) -> Optional[genai.GenerativeModel]:
+        """
+        Model bound to a server-side cache of system prompt + context.
+        
+        A cache is only created once the same prefix shows up on two
+        consecutive turns and is large enough to be accepted; otherwise
+        returns None and the caller sends the full prompt.
+        """
+        key = self._prefix_key(context_chunks)
+        if key == self._cache_key and time.monotonic() < self._cache_expires:
+            return self._cached_model
+        
+        stable = key == self._last_key
+        self._last_key = key
+        if not stable or key == self._failed_key:
+            return None
+        
+        context_text = self._context_text(context_chunks)
+        if len(self.system_prompt) + len(context_text) < CACHE_MIN_CHARS:
+            return None
+        
+        try:
+            cache = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=MODEL_NAME,
+                system_instruction=self.system_prompt,
+                contents=[f"Relevant Context:\n{context_text}"] if context_text else None,
+                ttl=CACHE_TTL,
+            )
+        except Exception as e:
+            logger.warning(f"Context cache unavailable, sending full prompt: {e}")
+            self._failed_key = key
+            return None
+        
+        self._drop_cache()
+        self._cache = cache
+        self._cache_key = key
+        self._cached_model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+        # refresh a little before the server drops it
+        self._cache_expires = time.monotonic() + CACHE_TTL.total_seconds() - 30
+        logger.info(f"Created context cache {cache.name}")
+        return self._cached_model
+    
     async def generate_response(
         self,
         query: str,
         context_chunks: Optional[List[str]] = None,
-        conversation_history: Optional[List[Dict]] = None
+        conversation_history: Optional[Iterable[Dict]] = None,
+        summary: Optional[str] = None,
+        history_block: Optional[str] = None
     ) -> str:
         """
         Generate a response using Gemini with optional RAG context
@@ -34,45 +311,99 @@ class LLMService:
             query: User's question
             context_chunks: Retrieved context from knowledge base
             conversation_history: Previous conversation turns
+            summary: Rolling summary of turns older than the history window
+            history_block: Prebuilt "role: content" lines for the recent
+                turns; used instead of formatting conversation_history
             
         Returns:
             Generated response text
         """
-        try:
-            # Build the prompt with context
-            prompt_parts = [self.system_prompt]
-            
-            if context_chunks and len(context_chunks) > 0:
-                context_text = "\n\n".join([f"Context {i+1}:\n{chunk}" 
-                                           for i, chunk in enumerate(context_chunks)])
-                prompt_parts.append(f"\nRelevant Context:\n{context_text}")
-            
-            if conversation_history:
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" 
-                                         for msg in conversation_history[-5:]])
-                prompt_parts.append(f"\nConversation History:\n{history_text}")
-            
-            prompt_parts.append(f"\nUser Question: {query}")
-            prompt_parts.append("\nAssistant Response:")
-            
-            full_prompt = "\n".join(prompt_parts)
-            
-            # Generate response
-            response = self.model.generate_content(full_prompt)
-            
-            result_text = response.text
-            logger.info(f"Generated response for query: {query[:50]}...")
-            
-            return result_text
+        history_section = self._history_section(conversation_history, summary, history_block)
+        
+        key = _response_key(self.system_prompt, context_chunks, history_section, query)
+        cached = _response_cache.get(key)
+        if cached is not None:
+            logger.info(f"Response cache hit for query: {query[:50]}...")
+            return cached
         
+        # detached, so a caller that is cancelled doesn't cancel the others
+        task = _inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, query, context_chunks, history_section))
+            _inflight[key] = task
+            task.add_done_callback(functools.partial(_inflight_done, key))
+        try:
+            return await asyncio.shield(task)
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
+            # errors are handed to every waiter but never cached
             return f"I apologize, but I encountered an error: {str(e)}"
     
-    async def generate_stream(
+    async def _fetch(
+        self,
+        key: str,
+        query: str,
+        context_chunks: Optional[List[str]],
+        history_section: str
+    ) -> str:
+        result_text = await _redis_get(key)
+        if result_text is None:
+            result_text = await self._generate(query, context_chunks, history_section)
+            await _redis_set(key, result_text)
+        _response_cache[key] = result_text
+        return result_text
+    
+    async def _generate(
+        self,
+        query: str,
+        context_chunks: Optional[List[str]],
+        history_section: str
+    ) -> str:
+        response = None
+        cached_model = await self._get_cached_model(context_chunks)
+        if cached_model is not None:
+            # prefix already lives server-side; send only the delta
+            tail = "".join([
+                history_section,
+                "\n\nUser Question: ", query,
+                "\n\nAssistant Response:",
+            ]).lstrip()
+            try:
+                response = await cached_model.generate_content_async(tail)
+            except Exception as e:
+                logger.warning(f"Cached generation failed, retrying uncached: {e}")
+                self._cache_key = None
+        
+        if response is None:
+            full_prompt = self._build_prompt(query, context_chunks, history_section)
+            response = await self.model.generate_content_async(full_prompt)
+        
+        result_text = response.text
+        logger.info(f"Generated response for query: {query[:50]}...")
+        
+        return result_text
+    
+    async def generate_uncached(
         self,
         query: str,
         context_chunks: Optional[List[str]] = None
+    ) -> str:
+        """
+        One-off generation (e.g. background summaries): bypasses the response
+        and context caches, leaves the consecutive-turn prefix tracking alone,
+        and raises on failure instead of returning an apology.
+        """
+        full_prompt = self._build_prompt(query, context_chunks, "")
+        response = await self.model.generate_content_async(full_prompt)
+        return response.text
+    
+    async def generate_stream(
+        self,
+        query: str,
+        context_chunks: Optional[List[str]] = None,
+        conversation_history: Optional[Iterable[Dict]] = None,
+        summary: Optional[str] = None,
+        history_block: Optional[str] = None
     ):
         """
         Generate streaming response using Gemini
@@ -80,28 +411,24 @@ class LLMService:
         Args:
             query: User's question
             context_chunks: Retrieved context from knowledge base
+            conversation_history: Previous conversation turns
+            summary: Rolling summary of turns older than the history window
+            history_block: Prebuilt "role: content" lines for the recent
+                turns; used instead of formatting conversation_history
             
         Yields:
             Response text chunks
         """
         try:
-            prompt_parts = [self.system_prompt]
-            
-            if context_chunks and len(context_chunks) > 0:
-                context_text = "\n\n".join([f"Context {i+1}:\n{chunk}" 
-                                           for i, chunk in enumerate(context_chunks)])
-                prompt_parts.append(f"\nRelevant Context:\n{context_text}")
-            
-            prompt_parts.append(f"\nUser Question: {query}")
-            prompt_parts.append("\nAssistant Response:")
-            
-            full_prompt = "\n".join(prompt_parts)
+            history_section = self._history_section(conversation_history, summary, history_block)
+            full_prompt = self._build_prompt(query, context_chunks, history_section)
             
-            response = self.model.generate_content(full_prompt, stream=True)
+            response = await self.model.generate_content_async(full_prompt, stream=True)
             
-            for chunk in response:
-                if chunk.text:
-                    yield chunk.text
+            async for chunk in response:
+                text = _chunk_text(chunk)
+                if text:
+                    yield text
         
         except Exception as e:
             logger.error(f"Error in streaming LLM response: {e}")
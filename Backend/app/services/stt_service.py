@@ -1,9 +1,26 @@
 import logging
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, List
 import asyncio
 
+from deepgram import (
+    DeepgramClient,
+    DeepgramClientOptions,
+    LiveOptions,
+    LiveTranscriptionEvents,
+)
+
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000
+ENDPOINTING_MS = 300         # silence that ends an utterance
+TRANSCRIPT_TIMEOUT_S = 5.0   # wait for the final transcript after a flush
+
+# Outgoing frames are coalesced: one WebSocket send per 100 ms of audio.
+# The deadline runs from the first buffered frame and spans the same 100 ms,
+# so real-time 20 ms frames fill a send instead of timing out one by one.
+FLUSH_BYTES = SAMPLE_RATE * 2 // 10   # 100 ms of 16-bit mono
+FLUSH_WAIT_S = 0.100
+
 
 class STTService:
     """Speech-to-Text service using Deepgram"""
@@ -11,15 +28,133 @@ class STTService:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.connection = None
+        # finalized utterances, fed by the Deepgram callback
+        self._transcripts: asyncio.Queue = asyncio.Queue()
+        self._segments: List[str] = []
+        # cleared while a Finalize is unanswered
+        self._finalized = asyncio.Event()
+        self._finalized.set()
+        self._connect_lock = asyncio.Lock()
     
     async def initialize(self):
         """Initialize the STT connection"""
         try:
+            await self._connect()
             logger.info("STT service initialized")
         except Exception as e:
             logger.error(f"Error initializing STT: {e}")
             raise
     
+    async def _connect(self):
+        """Open the room's single streaming connection; reused until it fails"""
+        # keepalive stops Deepgram closing the socket between utterances
+        client = DeepgramClient(self.api_key, DeepgramClientOptions(options={"keepalive": "true"}))
+        connection = client.listen.asyncwebsocket.v("1")
+        connection.on(LiveTranscriptionEvents.Transcript, self._on_transcript)
+        connection.on(LiveTranscriptionEvents.Error, self._on_error)
+        connection.on(LiveTranscriptionEvents.Close, self._on_close)
+        
+        options = LiveOptions(
+            model="nova-2",
+            encoding="linear16",
+            sample_rate=SAMPLE_RATE,
+            channels=1,
+            interim_results=True,
+            endpointing=ENDPOINTING_MS,
+            smart_format=True,
+        )
+        if not await connection.start(options):
+            raise RuntimeError("Could not open Deepgram connection")
+        self.connection = connection
+        self._segments.clear()
+        self._finalized.set()
+    
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self.connection is None or not await self.connection.is_connected():
+                logger.info("Reconnecting to Deepgram")
+                await self._connect()
+    
+    async def _on_transcript(self, client, result, **kwargs):
+        text = result.channel.alternatives[0].transcript
+        if result.is_final and text:
+            self._segments.append(text)
+        # speech_final marks the endpoint; from_finalize answers an explicit flush
+        if (result.speech_final or result.from_finalize) and self._segments:
+            self._transcripts.put_nowait(" ".join(self._segments))
+            self._segments.clear()
+        if result.from_finalize:
+            self._finalized.set()
+    
+    async def _on_error(self, client, error, **kwargs):
+        logger.error(f"Deepgram error: {error}")
+        self.connection = None
+        self._finalized.set()       # a dead connection answers nothing
+    
+    async def _on_close(self, client, close, **kwargs):
+        if client is self.connection:
+            self.connection = None
+            self._finalized.set()
+    
+    async def send(self, audio_chunk: bytes):
+        """Push audio into the persistent connection, reconnecting if it dropped"""
+        await self._ensure_connected()
+        if not await self.connection.send(audio_chunk):
+            self.connection = None
+            await self._ensure_connected()
+            await self.connection.send(audio_chunk)
+    
+    async def _pump(self, audio_stream: AsyncIterator[bytes]):
+        loop = asyncio.get_running_loop()
+        frames = audio_stream.__aiter__()
+        buffer = bytearray()
+        deadline = 0.0
+        next_frame = None
+        try:
+            while True:
+                if next_frame is None:
+                    next_frame = asyncio.ensure_future(frames.__anext__())
+                timeout = max(deadline - loop.time(), 0) if buffer else None
+                try:
+                    # shield: a flush timeout must not cancel the pending read
+                    frame = await asyncio.wait_for(asyncio.shield(next_frame), timeout)
+                except asyncio.TimeoutError:
+                    await self.send(bytes(buffer))
+                    buffer.clear()
+                    continue
+                except StopAsyncIteration:
+                    break
+                next_frame = None
+                
+                if not buffer:
+                    deadline = loop.time() + FLUSH_WAIT_S
+                buffer += frame
+                if len(buffer) >= FLUSH_BYTES:
+                    await self.send(bytes(buffer))
+                    buffer.clear()
+            
+            if buffer:
+                await self.send(bytes(buffer))
+            await self._finalize()
+        finally:
+            if next_frame is not None:
+                next_frame.cancel()
+    
+    async def _finalize(self):
+        """Flush Deepgram's pending audio; _finalized is set once it answers"""
+        connection = self.connection        # _on_error may drop it at any await
+        if connection is None:
+            return
+        self._finalized.clear()
+        await connection.finalize()
+    
+    async def _await_finalize(self):
+        if not self._finalized.is_set():
+            try:
+                await asyncio.wait_for(self._finalized.wait(), TRANSCRIPT_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                logger.warning("Finalize was not answered")
+    
     async def transcribe_stream(self, audio_stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
         """
         Transcribe streaming audio to text
@@ -28,16 +163,27 @@ class STTService:
             audio_stream: Async iterator of audio bytes
             
         Yields:
-            Transcribed text chunks
+            Finalized utterance transcripts, as each endpoint is detected
         """
+        pump = asyncio.create_task(self._pump(audio_stream))
         try:
-            async for audio_chunk in audio_stream:
-                # In production, this would connect to Deepgram's streaming API
-                # For now, this is a placeholder
-                yield ""
+            while not pump.done():
+                getter = asyncio.ensure_future(self._transcripts.get())
+                done, _ = await asyncio.wait({getter, pump}, return_when=asyncio.FIRST_COMPLETED)
+                # a getter that completed while being cancelled still holds its item
+                if getter in done or not getter.cancel():
+                    yield getter.result()
+            pump.result()
+            
+            # audio ended: the finalize answer carries any last utterance
+            await self._await_finalize()
+            while not self._transcripts.empty():
+                yield self._transcripts.get_nowait()
         except Exception as e:
             logger.error(f"Error in STT transcription: {e}")
             raise
+        finally:
+            pump.cancel()
     
     async def transcribe(self, audio_data: bytes) -> str:
         """
@@ -50,9 +196,18 @@ class STTService:
             Transcribed text
         """
         try:
-            # Placeholder for actual Deepgram transcription
             logger.info("Transcribing audio...")
-            return ""
+            while not self._transcripts.empty():   # drop stale utterances
+                self._transcripts.get_nowait()
+            
+            await self.send(audio_data)
+            await self._finalize()
+            await self._await_finalize()
+            # silence or noise: the finalize answer comes back with no text
+            parts = []
+            while not self._transcripts.empty():
+                parts.append(self._transcripts.get_nowait())
+            return " ".join(parts)
         except Exception as e:
             logger.error(f"Error transcribing audio: {e}")
             raise
@@ -60,5 +215,6 @@ class STTService:
     async def close(self):
         """Close the STT connection"""
         if self.connection:
-            await self.connection.close()
+            await self.connection.finish()
+            self.connection = None
             logger.info("STT connection closed")
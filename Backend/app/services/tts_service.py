@@ -1,9 +1,41 @@
 import logging
-from typing import Optional
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import asyncio
 
 logger = logging.getLogger(__name__)
 
+# Synthesis runs here so a local or blocking engine never stalls the event
+# loop, and several sentences can be voiced at once.
+TTS_WORKERS = 4
+_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+_SENT_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences for synthesis"""
+    return [s for s in _SENT_BOUNDARY.split(text.strip()) if s]
+
+
+class SentenceChunker:
+    """Cuts streamed LLM text into sentences as soon as each one completes"""
+    
+    def __init__(self):
+        self._carry = ""
+    
+    def feed(self, text: str) -> List[str]:
+        """Add a chunk; return the sentences it completed"""
+        parts = _SENT_BOUNDARY.split(self._carry + text)
+        self._carry = parts.pop()       # unfinished sentence waits for more text
+        return [s.strip() for s in parts if s.strip()]
+    
+    def flush(self) -> Optional[str]:
+        """Return whatever is left once the stream ends"""
+        tail, self._carry = self._carry.strip(), ""
+        return tail or None
+
 
 class TTSService:
     """Text-to-Speech service using Google TTS"""
@@ -34,13 +66,18 @@ class TTSService:
         """
         try:
             logger.info(f"Synthesizing text: {text[:50]}...")
-            # Placeholder - in production this would call Google TTS API
-            # Return empty bytes for now
-            return b""
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor, self._synthesize_sync, text)
         except Exception as e:
             logger.error(f"Error synthesizing speech: {e}")
             raise
     
+    def _synthesize_sync(self, text: str) -> bytes:
+        """Blocking synthesis call; runs on the TTS thread pool"""
+        # Placeholder - in production this would call Google TTS API
+        # Return empty bytes for now
+        return b""
+    
     async def synthesize_stream(self, text: str):
         """
         Convert text to speech with streaming output
@@ -54,7 +91,8 @@ class TTSService:
         try:
             logger.info(f"Synthesizing text stream: {text[:50]}...")
             # Placeholder for streaming TTS
-            yield b""
+            loop = asyncio.get_running_loop()
+            yield await loop.run_in_executor(_executor, self._synthesize_sync, text)
         except Exception as e:
             logger.error(f"Error in streaming TTS: {e}")
             raise
@@ -1,17 +1,59 @@
 import logging
 import asyncio
-from typing import Optional, Dict, List
+import string
+import sys
+import time
+from collections import deque, namedtuple
+from typing import AsyncIterator, Deque, Optional, Dict, List
 from datetime import datetime
 
 from app.services.stt_service import STTService
-from app.services.llm_service import LLMService
-from app.services.tts_service import TTSService
+from app.services.llm_service import LLMService, HISTORY_TURNS
+from app.services.tts_service import TTSService, SentenceChunker, split_sentences
 from app.services.knowledge_base import KnowledgeBaseService
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Bounded hand-off between pipeline stages: a stalled consumer applies
+# back-pressure instead of buffering a whole reply.
+STAGE_QUEUE_SIZE = 4
+
+# Memory per room stays bounded: only the newest turns are kept verbatim
+# and everything older is folded into a rolling summary.
+HISTORY_MAX_TURNS = 64
+SUMMARY_EVERY = 32
+SUMMARY_QUERY = (
+    "Summarize the earlier conversation summary and the transcript above "
+    "in a few sentences. Keep names, facts, decisions and open questions."
+)
+
+WARMUP_TIMEOUT_S = 5.0
+
+# Disfluencies and bare acknowledgements: a turn made only of these gets
+# no answer and never reaches retrieval or the LLM.
+FILLERS = frozenset({
+    "um", "umm", "uh", "uhh", "uhm", "er", "erm", "ah", "hm", "hmm", "mm",
+    "mhm", "oh", "yeah", "yep", "ok", "okay",
+})
+
+
+def _is_filler(text: str) -> bool:
+    words = [w.strip(string.punctuation) for w in text.lower().split()]
+    return all(w in FILLERS for w in words if w)
+
+
+# One compact record per turn; roles are interned so every turn shares
+# the same two string objects.
+Turn = namedtuple("Turn", "role content ts")
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+# Retrieval reuse: an utterance whose embedding is near-identical to the
+# previous query keeps that turn's context instead of running another search.
+RETRIEVAL_REUSE_SIM = 0.9
+
 
 class VoiceAgent:
     """
@@ -29,21 +71,63 @@ class VoiceAgent:
         if system_prompt:
             self.llm_service.set_system_prompt(system_prompt)
         
-        self.conversation_history: List[Dict] = []
+        self.conversation_history: Deque[Turn] = deque(maxlen=HISTORY_MAX_TURNS)
+        self._summary = ""
+        self._turns_since_summary = 0
+        self._summary_task: Optional[asyncio.Task] = None
+        # prompt-ready lines for the last HISTORY_TURNS turns, kept incrementally
+        self._history_block = ""
+        self._history_lens: Deque[int] = deque()
+        # turns carry monotonic ns; this maps them back to wall-clock time
+        self._clock_offset_ns = time.time_ns() - time.monotonic_ns()
         self.is_running = False
         self.sources_used: List[str] = []
+        self._last_query_vec = None
+        self._last_rag: Optional[Dict] = None
     
     async def initialize(self):
         """Initialize all services"""
         try:
             await self.stt_service.initialize()
             await self.tts_service.initialize()
+            await self._warmup()
             self.is_running = True
             logger.info(f"Voice agent initialized for room: {self.room_name}")
         except Exception as e:
             logger.error(f"Error initializing voice agent: {e}")
             raise
     
+    async def _warmup(self):
+        """Open the LLM/TTS connections and touch the index before the first turn"""
+        try:
+            results = await asyncio.wait_for(asyncio.gather(
+                self.llm_service.model.generate_content_async(
+                    "ping", generation_config={"max_output_tokens": 1}
+                ),
+                self.tts_service.synthesize(" "),
+                self.kb_service.retrieve("warmup", top_k=1),
+                return_exceptions=True
+            ), WARMUP_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            logger.warning(f"Warm-up timed out for room: {self.room_name}")
+            return
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Warm-up call failed: {result}")
+    
+    async def _retrieve(self, user_text: str) -> Dict:
+        """Retrieve context, reusing the previous turn's when the query barely changed"""
+        q_vec = await self.kb_service.embed_query(user_text)
+        # vectors are unit-normalised, so the dot product is the cosine
+        if self._last_rag is not None and float(q_vec[0] @ self._last_query_vec[0]) > RETRIEVAL_REUSE_SIM:
+            logger.info(f"Reusing previous context for: {user_text[:50]}")
+            return self._last_rag
+        
+        # the query embedding is cached, so retrieve() doesn't encode it again
+        rag_result = await self.kb_service.retrieve(user_text, top_k=3)
+        self._last_query_vec, self._last_rag = q_vec, rag_result
+        return rag_result
+    
     async def process_audio_input(self, audio_data: bytes) -> Dict:
         """
         Process incoming audio through the complete pipeline
@@ -58,7 +142,7 @@ class VoiceAgent:
             # Step 1: STT - Convert speech to text
             user_text = await self.stt_service.transcribe(audio_data)
             
-            if not user_text:
+            if not user_text or _is_filler(user_text):
                 return {
                     "response_audio": None,
                     "transcript": "",
@@ -68,14 +152,10 @@ class VoiceAgent:
             logger.info(f"User said: {user_text}")
             
             # Add to conversation history
-            self.conversation_history.append({
-                "role": "user",
-                "content": user_text,
-                "timestamp": datetime.now().isoformat()
-            })
+            self._add_turn(USER, user_text)
             
             # Step 2: RAG - Retrieve relevant context
-            rag_result = await self.kb_service.retrieve(user_text, top_k=3)
+            rag_result = await self._retrieve(user_text)
             context_chunks = rag_result["chunks"]
             self.sources_used = rag_result["sources"]
             
@@ -83,20 +163,22 @@ class VoiceAgent:
             response_text = await self.llm_service.generate_response(
                 query=user_text,
                 context_chunks=context_chunks,
-                conversation_history=self.conversation_history
+                conversation_history=self.conversation_history,
+                summary=self._summary,
+                history_block=self._history_block
             )
             
             logger.info(f"Assistant response: {response_text}")
             
             # Add to conversation history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": response_text,
-                "timestamp": datetime.now().isoformat()
-            })
+            self._add_turn(ASSISTANT, response_text)
             
-            # Step 4: TTS - Convert response to speech
-            response_audio = await self.tts_service.synthesize(response_text)
+            # Step 4: TTS - Convert response to speech, sentences in parallel
+            sentences = split_sentences(response_text)
+            audio_parts = await asyncio.gather(
+                *(self.tts_service.synthesize(sentence) for sentence in sentences)
+            )
+            response_audio = b"".join(audio_parts)
             
             return {
                 "response_audio": response_audio,
@@ -113,6 +195,95 @@ class VoiceAgent:
                 "sources": []
             }
     
+    async def process_audio_stream(self, audio_stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Streaming pipeline: STT, LLM and TTS run concurrently
+        
+        Each finished utterance from STT is answered while the user may
+        still be talking, and the reply is voiced sentence by sentence as
+        the LLM produces it, so audio starts before the full reply exists.
+        
+        Args:
+            audio_stream: Async iterator of raw audio bytes from user
+            
+        Yields:
+            Response audio chunks
+        """
+        utterances: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+        sentences: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+        voicing: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)   # synthesis tasks, reply order
+        audio_out: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+        
+        async def stt_stage():
+            try:
+                async for text in self.stt_service.transcribe_stream(audio_stream):
+                    if text.strip() and not _is_filler(text):
+                        await utterances.put(text.strip())
+            except Exception as e:
+                logger.error(f"STT stage failed: {e}")
+            await utterances.put(None)     # end of stream (skipped on cancel)
+        
+        async def llm_stage():
+            try:
+                while (user_text := await utterances.get()) is not None:
+                    logger.info(f"User said: {user_text}")
+                    self._add_turn(USER, user_text)
+                    
+                    rag_result = await self._retrieve(user_text)
+                    self.sources_used = rag_result["sources"]
+                    
+                    reply, chunker = [], SentenceChunker()
+                    async for piece in self.llm_service.generate_stream(
+                        query=user_text,
+                        context_chunks=rag_result["chunks"],
+                        conversation_history=self.conversation_history,
+                        summary=self._summary,
+                        history_block=self._history_block
+                    ):
+                        reply.append(piece)
+                        for sentence in chunker.feed(piece):
+                            await sentences.put(sentence)
+                    if (tail := chunker.flush()):
+                        await sentences.put(tail)
+                    
+                    response_text = "".join(reply)
+                    logger.info(f"Assistant response: {response_text}")
+                    self._add_turn(ASSISTANT, response_text)
+            except Exception as e:
+                logger.error(f"LLM stage failed: {e}")
+            await sentences.put(None)     # end of stream (skipped on cancel)
+        
+        async def tts_stage():
+            # start each sentence as soon as it arrives; up to the queue
+            # size synthesize in parallel while earlier ones play
+            while (sentence := await sentences.get()) is not None:
+                await voicing.put(asyncio.create_task(self.tts_service.synthesize(sentence)))
+            await voicing.put(None)     # end of stream (skipped on cancel)
+        
+        async def emit_stage():
+            try:
+                while (synthesis := await voicing.get()) is not None:
+                    audio = await synthesis
+                    if audio:
+                        await audio_out.put(audio)
+            except Exception as e:
+                logger.error(f"TTS stage failed: {e}")
+            await audio_out.put(None)     # end of stream (skipped on cancel)
+        
+        stages = (stt_stage, llm_stage, tts_stage, emit_stage)
+        tasks = [asyncio.create_task(stage()) for stage in stages]
+        try:
+            while (audio := await audio_out.get()) is not None:
+                yield audio
+        finally:
+            for task in tasks:
+                task.cancel()
+            while not voicing.empty():
+                synthesis = voicing.get_nowait()
+                if synthesis is not None:
+                    synthesis.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
     async def process_text_query(self, query: str) -> Dict:
         """
         Process a text query (useful for testing)
@@ -133,7 +304,9 @@ class VoiceAgent:
             response = await self.llm_service.generate_response(
                 query=query,
                 context_chunks=context_chunks,
-                conversation_history=self.conversation_history
+                conversation_history=self.conversation_history,
+                summary=self._summary,
+                history_block=self._history_block
             )
             
             return {
@@ -150,6 +323,40 @@ class VoiceAgent:
                 "chunks": []
             }
     
+    def _add_turn(self, role: str, content: str):
+        """Record a turn and periodically fold older turns into the summary"""
+        self.conversation_history.append(Turn(role, content, time.monotonic_ns()))
+        
+        line = f"{role}: {content}"
+        self._history_block = f"{self._history_block}\n{line}" if self._history_block else line
+        self._history_lens.append(len(line))
+        if len(self._history_lens) > HISTORY_TURNS:
+            self._history_block = self._history_block[self._history_lens.popleft() + 1:]
+        
+        self._turns_since_summary += 1
+        if self._turns_since_summary >= SUMMARY_EVERY and (
+            self._summary_task is None or self._summary_task.done()
+        ):
+            turns = list(self.conversation_history)[-self._turns_since_summary:]
+            self._turns_since_summary = 0
+            self._summary_task = asyncio.create_task(self._summarize(turns))
+    
+    async def _summarize(self, turns: List[Turn]):
+        """Fold a window of turns into the rolling summary (runs in background)"""
+        transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        chunks = [f"Earlier summary:\n{self._summary}"] if self._summary else []
+        chunks.append(f"Transcript:\n{transcript}")
+        try:
+            summary = await self.llm_service.generate_uncached(
+                query=SUMMARY_QUERY,
+                context_chunks=chunks
+            )
+        except Exception as e:
+            logger.warning(f"Keeping previous summary for room {self.room_name}: {e}")
+            return
+        self._summary = summary.strip()
+        logger.info(f"Updated conversation summary for room {self.room_name}")
+    
     def update_system_prompt(self, prompt: str):
         """Update the system prompt"""
         self.llm_service.set_system_prompt(prompt)
@@ -157,17 +364,36 @@ class VoiceAgent:
     
     def get_conversation_history(self) -> List[Dict]:
         """Get the conversation history"""
-        return self.conversation_history
+        return [
+            {
+                "role": turn.role,
+                "content": turn.content,
+                "timestamp": datetime.fromtimestamp(
+                    (turn.ts + self._clock_offset_ns) / 1e9
+                ).isoformat()
+            }
+            for turn in self.conversation_history
+        ]
     
     def clear_conversation_history(self):
         """Clear the conversation history"""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._history_block = ""
+        self._history_lens.clear()
+        self._summary = ""
+        self._turns_since_summary = 0
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+        self._last_query_vec = None
+        self._last_rag = None
         logger.info(f"Cleared conversation history for room {self.room_name}")
     
     async def shutdown(self):
         """Shutdown the agent and cleanup resources"""
         try:
             self.is_running = False
+            if self._summary_task is not None:
+                self._summary_task.cancel()
             await self.stt_service.close()
             logger.info(f"Voice agent shutdown for room: {self.room_name}")
         except Exception as e: